@@ -1,12 +1,21 @@
-import xml.etree.ElementTree as ET
+import numpy as np
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import plotly.graph_objects as go
+from tsdownsample import LTTBDownsampler
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
+import threading
+import hashlib
 
 # === Config ===
 XML_DIR = "applehealthdata/apple_health_export"
+CACHE_DIR = ".cache"
+# Bump whenever parsing or dtypes change so stale parquet caches are ignored
+CACHE_VERSION = 2
+MAX_PLOT_POINTS = 2000
 
 GAIT_METRICS = {
     'HKQuantityTypeIdentifierWalkingSpeed': ('Walking Speed (m/s)', 0.8, 'low'),
@@ -20,80 +29,131 @@ FLARE_DATES = [
     ("2025-07-10", "2025-07-12"),
 ]
 
+RECORD_ATTRS = ['type', 'unit', 'value', 'startDate']
+METRIC_LABELS = {key: meta[0] for key, meta in GAIT_METRICS.items()}
+# Gait records selected inside libxml2, so other record types never reach Python
+RECORD_XPATH = "//Record[" + " or ".join(f"@type='{key}'" for key in GAIT_METRICS) + "]"
+# Exports above this size are streamed instead, since XPath needs the whole tree in memory
+STREAM_PARSE_BYTES = 100 * 1024 * 1024
+
 # === Parser ===
 @st.cache_data
 def parse_apple_health_xml(path):
-    tree = ET.parse(path)
-    root = tree.getroot()
-
-    records = []
-    for record in root.findall('Record'):
-        rtype = record.get('type')
-        if rtype not in GAIT_METRICS:
-            continue
-        try:
-            value = float(record.get('value'))
-            date = pd.to_datetime(record.get('startDate')).date()
-            unit = record.get('unit')
-        except Exception:
-            continue
-        records.append({
-            'Metric': GAIT_METRICS[rtype][0],
-            'Date': date,
-            'Value': value,
-            'Unit': unit,
-            'TypeID': rtype
-        })
-
-    df = pd.DataFrame(records)
+    # Reuse the parsed frame from disk as long as the export and the parser haven't changed
+    path_key = hashlib.md5(path.encode()).hexdigest()
+    version_key = hashlib.md5(f"{os.path.getmtime(path)}:{CACHE_VERSION}".encode()).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"{path_key}_{version_key}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    try:
+        if os.path.getsize(path) > STREAM_PARSE_BYTES:
+            raw = pd.read_xml(path, parser="lxml", iterparse={'Record': RECORD_ATTRS},
+                              dtype_backend="pyarrow")
+        else:
+            raw = pd.read_xml(path, parser="lxml", xpath=RECORD_XPATH,
+                              dtype_backend="pyarrow").reindex(columns=RECORD_ATTRS)
+    except ValueError:
+        # No matching records (pandas raises instead of returning an empty frame)
+        raw = pd.DataFrame(columns=RECORD_ATTRS)
+
+    raw = raw[raw['type'].isin(list(GAIT_METRICS))]
+
+    # Dates are kept in the export's local time, so only the date part is parsed
+    df = pd.DataFrame({
+        'Metric': raw['type'].map(METRIC_LABELS),
+        'Date': pd.to_datetime(raw['startDate'].str.slice(0, 10), format="%Y-%m-%d", errors='coerce'),
+        'Value': pd.to_numeric(raw['value'], errors='coerce').astype('float32'),
+        'Unit': raw['unit'],
+        'TypeID': raw['type']
+    })
+    # A handful of distinct strings per column: store them once as categories
+    for col in ('Metric', 'Unit', 'TypeID'):
+        df[col] = df[col].astype('category')
+    # Sorted once here; everything downstream relies on Date order
+    df = df.dropna(subset=['Metric', 'Date', 'Value']).sort_values('Date', kind='stable').reset_index(drop=True)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(cache_path, compression="zstd")
+        # Drop caches of earlier versions of this export
+        for name in os.listdir(CACHE_DIR):
+            if name.startswith(f"{path_key}_") and name != os.path.basename(cache_path):
+                os.remove(os.path.join(CACHE_DIR, name))
+    except OSError:
+        pass  # disk cache is best-effort
     return df
 
+# Flare dates parsed once at import
+FLARE_SPANS = [(pd.Timestamp(start_str), pd.Timestamp(end_str)) for start_str, end_str in FLARE_DATES]
+
 def get_flare_shapes(ymin, ymax):
-    shapes = []
-    for start_str, end_str in FLARE_DATES:
-        shapes.append({
-            "type": "rect",
-            "xref": "x",
-            "yref": "y",
-            "x0": pd.to_datetime(start_str),
-            "x1": pd.to_datetime(end_str),
-            "y0": ymin,
-            "y1": ymax,
-            "fillcolor": "rgba(255,0,0,0.1)",
-            "line": {"width": 0}
-        })
-    return shapes
-
-def build_chart(df, label, pop_thresh, direction):
-    df = df.sort_values("Date")
-    df["Smoothed"] = df["Value"].rolling(window=7, min_periods=1).mean()
-
-    baseline = df["Value"].mean()
-    std = df["Value"].std()
+    return [{
+        "type": "rect",
+        "xref": "x",
+        "yref": "y",
+        "x0": start,
+        "x1": end,
+        "y0": ymin,
+        "y1": ymax,
+        "fillcolor": "rgba(255,0,0,0.1)",
+        "line": {"width": 0}
+    } for start, end in FLARE_SPANS]
+
+def downsample(x, y, n_out=MAX_PLOT_POINTS):
+    """Reduce a trace to n_out points with LTTB, keeping its visual shape"""
+    if len(x) <= n_out:
+        return x, y
+    idx = LTTBDownsampler().downsample(x.to_numpy().astype("int64"), y.to_numpy(), n_out=n_out)
+    return x.iloc[idx], y.iloc[idx]
+
+def rolling_mean(values, window=7):
+    """Trailing mean over `window` samples (shorter at the start), from one cumulative sum"""
+    cs = np.concatenate(([0.0], np.cumsum(values, dtype="float64")))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    return (cs[end] - cs[start]) / (end - start)
+
+@st.cache_data(show_spinner=False)
+def compute_stats(values):
+    """Smoothed series, baseline and spread for one metric; reused across reruns"""
+    return rolling_mean(values.to_numpy(), window=7), values.mean(), values.std()
+
+def build_chart(df, label, pop_thresh, direction, fig=None):
+    smoothed, baseline, std = compute_stats(df["Value"])
+    # New frame with the extra column; the partitioned frame stays untouched
+    df = df.assign(Smoothed=smoothed)
+
     low_thresh = baseline - 2 * std
     warn_thresh = baseline - 1 * std
 
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df["Date"], y=df["Value"], name="Raw", mode="lines"))
-    fig.add_trace(go.Scatter(x=df["Date"], y=df["Smoothed"], name="Smoothed", mode="lines"))
-
-    fig.add_trace(go.Scatter(x=df["Date"], y=[warn_thresh]*len(df), name="Personal Caution (−1σ)",
-                             line=dict(dash="dot", color="orange")))
-    fig.add_trace(go.Scatter(x=df["Date"], y=[low_thresh]*len(df), name="Personal Alert (−2σ)",
-                             line=dict(dash="dash", color="red")))
+    raw_x, raw_y = downsample(df["Date"], df["Value"])
+    smooth_x, smooth_y = downsample(df["Date"], df["Smoothed"])
+    if fig is None:
+        fig = go.Figure()
+        fig.add_trace(go.Scattergl(x=raw_x, y=raw_y, name="Raw", mode="lines"))
+        fig.add_trace(go.Scattergl(x=smooth_x, y=smooth_y, name="Smoothed", mode="lines"))
+        fig.update_layout(xaxis_title="Date", legend_title="Legend")
+    else:
+        # Figure from a previous render: swap in the new data instead of rebuilding the traces
+        with fig.batch_update():
+            fig.data[0].x, fig.data[0].y = raw_x, raw_y
+            fig.data[1].x, fig.data[1].y = smooth_x, smooth_y
+
+    # Assigned rather than passed to update_layout, which would merge into the previous lists
+    fig.layout.shapes = get_flare_shapes(df["Value"].min(), df["Value"].max())
+    fig.layout.annotations = []
+    fig.update_layout(title=f"{label} Over Time", yaxis_title=df["Unit"].iloc[0])
+
+    # Thresholds are layout lines, added after the flare shapes so they aren't replaced
+    fig.add_hline(y=warn_thresh, line_dash="dot", line_color="orange",
+                  annotation_text="Personal Caution (−1σ)")
+    fig.add_hline(y=low_thresh, line_dash="dash", line_color="red",
+                  annotation_text="Personal Alert (−2σ)")
 
     if pop_thresh is not None:
-        fig.add_trace(go.Scatter(x=df["Date"], y=[pop_thresh]*len(df), name="Population Threshold",
-                                 line=dict(dash="dot", color="green")))
-
-    shapes = get_flare_shapes(df["Value"].min(), df["Value"].max())
-    fig.update_layout(
-        title=f"{label} Over Time",
-        yaxis_title=df["Unit"].iloc[0],
-        xaxis_title="Date",
-        legend_title="Legend",
-        shapes=shapes
-    )
+        fig.add_hline(y=pop_thresh, line_dash="dot", line_color="green",
+                      annotation_text="Population Threshold")
 
     return fig, df, baseline, std, pop_thresh, direction
 
@@ -122,18 +182,43 @@ if df_all.empty:
     st.error("No gait-related records found.")
     st.stop()
 
+# Partition once by metric so each tab is a dict lookup instead of a full scan;
+# groups keep the Date order from parsing
+df_by_type = {key: group.reset_index(drop=True)
+              for key, group in df_all.groupby("TypeID", sort=False, observed=True)}
+
+# === Build charts ===
+# Metrics are independent and the work is mostly in NumPy/pandas, so build them concurrently.
+# Worker threads share this run's context so cached functions behave as on the main thread.
+ctx = get_script_run_ctx()
+
+# Figures are kept in session state and updated in place on later reruns.
+previous_figs = {key: st.session_state.get(f"fig_{key}") for key in GAIT_METRICS}
+
+# Metrics without data are skipped before any work is scheduled
+chart_keys = [key for key in GAIT_METRICS if key in df_by_type and not df_by_type[key].empty]
+
+def build_metric_chart(key):
+    return build_chart(df_by_type[key], *GAIT_METRICS[key], fig=previous_figs[key])
+
+with ThreadPoolExecutor(max_workers=len(GAIT_METRICS),
+                        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+    charts = dict(zip(chart_keys, executor.map(build_metric_chart, chart_keys)))
+
+for key, chart in charts.items():
+    st.session_state[f"fig_{key}"] = chart[0]
+
 # === Metric Tabs ===
 tabs = st.tabs([GAIT_METRICS[key][0] for key in GAIT_METRICS])
 
 for i, key in enumerate(GAIT_METRICS):
     label, pop_thresh, direction = GAIT_METRICS[key]
     with tabs[i]:
-        df_metric = df_all[df_all["TypeID"] == key].copy()
-        if df_metric.empty:
+        if key not in charts:
             st.warning(f"No data found for {label}")
             continue
 
-        fig, df_metric, baseline, std, pop_thresh, direction = build_chart(df_metric, label, pop_thresh, direction)
+        fig, df_metric, baseline, std, pop_thresh, direction = charts[key]
         st.plotly_chart(fig, use_container_width=True)
 
         latest = df_metric["Value"].iloc[-1]
@@ -157,4 +242,4 @@ for i, key in enumerate(GAIT_METRICS):
                 st.success("✅ Within normal range.")
 
         st.subheader("Recent Entries")
-        st.dataframe(df_metric.sort_values("Date", ascending=False).head(10))
+        st.dataframe(df_metric.tail(10).iloc[::-1])
@@ -1,6 +1,10 @@
 # dashboard.py - Streamlit Dashboard Optimized for Render
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+from numba import njit
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -23,6 +27,18 @@ st.set_page_config(
     page_icon="💊"
 )
 
+@st.cache_resource
+def get_http_session():
+    """Shared HTTP session so API calls reuse pooled keep-alive connections across reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                          max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+SESSION = get_http_session()
+
 # Initialize session state for alerts and connection status
 if 'last_alert_check' not in st.session_state:
     st.session_state.last_alert_check = datetime.now()
@@ -35,7 +51,7 @@ if 'connection_status' not in st.session_state:
 def test_api_connection():
     """Test connection to backend API"""
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
+        response = SESSION.get(f"{API_BASE_URL}/health", timeout=5)
         if response.status_code == 200:
             data = response.json()
             st.session_state.connection_status = 'connected'
@@ -51,7 +67,7 @@ def test_api_connection():
 def get_patients():
     """Get list of patients with recent activity"""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/patients", timeout=10)
+        response = SESSION.get(f"{API_BASE_URL}/api/patients", timeout=10)
         if response.status_code == 200:
             return response.json()
         return []
@@ -59,20 +75,40 @@ def get_patients():
         st.error(f"Failed to fetch patients: {str(e)}")
         return []
 
+def records_to_frame(records, date_column):
+    """Build a DataFrame from API records, converting the date column back to datetime"""
+    if not records:
+        return pd.DataFrame()
+    df = pd.DataFrame(records)
+    if date_column in df.columns:
+        df[date_column] = pd.to_datetime(df[date_column])
+    return df
+
+@st.cache_data(ttl=30)  # Cache for 30 seconds
+def get_bundle(patient_id, days=30):
+    """Get the patient list and one patient's data and medication history in one request"""
+    try:
+        response = SESSION.get(f"{API_BASE_URL}/api/bundle/{patient_id}?days={days}", timeout=10)
+        if response.status_code == 200:
+            bundle = response.json()
+            return {
+                'patient_id': patient_id,
+                'patients': bundle.get('patients', []),
+                'data': records_to_frame(bundle.get('data'), 'timestamp'),
+                'medication_history': records_to_frame(bundle.get('medication_history'), 'change_date')
+            }
+        return None
+    except Exception as e:
+        st.error(f"Failed to fetch patient bundle: {str(e)}")
+        return None
+
 @st.cache_data(ttl=30)  # Cache for 30 seconds
 def get_patient_data(patient_id, days=30):
     """Get patient gait data"""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/patient/{patient_id}/data?days={days}", timeout=10)
+        response = SESSION.get(f"{API_BASE_URL}/api/patient/{patient_id}/data?days={days}", timeout=10)
         if response.status_code == 200:
-            data = response.json()
-            if data:
-                df = pd.DataFrame(data)
-                # Convert timestamp strings back to datetime
-                if 'timestamp' in df.columns:
-                    df['timestamp'] = pd.to_datetime(df['timestamp'])
-                return df
-            return pd.DataFrame()
+            return records_to_frame(response.json(), 'timestamp')
         return pd.DataFrame()
     except Exception as e:
         st.error(f"Failed to fetch patient data: {str(e)}")
@@ -82,20 +118,44 @@ def get_patient_data(patient_id, days=30):
 def get_medication_history(patient_id):
     """Get medication change history"""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/patient/{patient_id}/medication-history", timeout=10)
+        response = SESSION.get(f"{API_BASE_URL}/api/patient/{patient_id}/medication-history", timeout=10)
         if response.status_code == 200:
-            data = response.json()
-            if data:
-                df = pd.DataFrame(data)
-                if 'change_date' in df.columns:
-                    df['change_date'] = pd.to_datetime(df['change_date'])
-                return df
-            return pd.DataFrame()
+            return records_to_frame(response.json(), 'change_date')
         return pd.DataFrame()
     except Exception as e:
         st.error(f"Failed to fetch medication history: {str(e)}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=60)  # Cache for 1 minute
+def build_patient_options(patients):
+    """Map patient IDs to dropdown labels, formatting all last-update times in one pass"""
+    last_updates = pd.to_datetime(
+        pd.Series([p.get('last_update') for p in patients], dtype=object),
+        errors='coerce', format='ISO8601'
+    )
+    labels = ("(Last: " + last_updates.dt.strftime('%m/%d %H:%M') + ")").fillna("(No recent data)")
+    return {p['patient_id']: f"{p['patient_id']} {label}" for p, label in zip(patients, labels)}
+
+def window_mean(values, start, end):
+    """Mean of values[start:end] ignoring NaNs; NaN if the window has no data"""
+    window = values[start:end]
+    window = window[~np.isnan(window)]
+    return window.mean() if window.size else np.nan
+
+def column_array(df, column, dtype, default):
+    """Column as a NumPy array with missing values (or a missing column) set to default"""
+    if column in df.columns:
+        return df[column].to_numpy(dtype=dtype, na_value=default)
+    return np.full(len(df), default, dtype=dtype)
+
+@njit(cache=True)
+def alert_mask(walking_speed, asymmetry_alert, double_support_alert, speed_threshold):
+    """Rows with a stored asymmetry/support alert or walking speed below the threshold"""
+    mask = np.zeros(len(walking_speed), np.bool_)
+    for i in range(len(walking_speed)):
+        mask[i] = asymmetry_alert[i] or double_support_alert[i] or walking_speed[i] < speed_threshold
+    return mask
+
 def log_medication_change(patient_id, medication_name, old_dosage, new_dosage, reason, pharmacist_id):
     """Log a new medication change"""
     data = {
@@ -109,7 +169,7 @@ def log_medication_change(patient_id, medication_name, old_dosage, new_dosage, r
     }
     
     try:
-        response = requests.post(f"{API_BASE_URL}/api/medication-change", json=data, timeout=10)
+        response = SESSION.post(f"{API_BASE_URL}/api/medication-change", json=data, timeout=10)
         return response.status_code == 200
     except Exception as e:
         st.error(f"Failed to log medication change: {str(e)}")
@@ -118,7 +178,7 @@ def log_medication_change(patient_id, medication_name, old_dosage, new_dosage, r
 def update_patient_thresholds(patient_id, thresholds):
     """Update patient alert thresholds"""
     try:
-        response = requests.post(f"{API_BASE_URL}/api/patient/{patient_id}/thresholds", json=thresholds, timeout=10)
+        response = SESSION.post(f"{API_BASE_URL}/api/patient/{patient_id}/thresholds", json=thresholds, timeout=10)
         return response.status_code == 200
     except Exception as e:
         st.error(f"Failed to update thresholds: {str(e)}")
@@ -128,7 +188,11 @@ def update_patient_thresholds(patient_id, thresholds):
 st.title("💊 Pharmacist Dashboard - Gait Monitoring")
 st.caption(f"Real-time monitoring and medication adjustment tracking for MS/Parkinson's patients")
 
-# Test API connection and show status
+# Once a patient has been selected, one bundle request covers patients and patient data
+bundle = get_bundle(st.session_state.selected_patient) if 'selected_patient' in st.session_state else None
+
+# Test API connection and show status. Always probed live: the bundle may be cached for up to
+# 30s, and the server only re-checks the database every few seconds, so this stays cheap
 health_data = test_api_connection()
 
 # Header with connection status and controls
@@ -164,7 +228,7 @@ if health_data:
             st.metric("Database", health_data.get('database', 'unknown'))
 
 # Patient selection
-patients = get_patients()
+patients = bundle['patients'] if bundle is not None else get_patients()
 if not patients:
     st.warning("No patients found. Ensure the backend is running and patients have sent data.")
     
@@ -185,26 +249,28 @@ if not patients:
     
     st.stop()
 
-# Patient selection dropdown
-patient_options = {}
-for p in patients:
-    last_update = p.get('last_update', 'Unknown')
-    if isinstance(last_update, str) and last_update != 'Unknown':
-        try:
-            # Format timestamp for display
-            dt = pd.to_datetime(last_update)
-            formatted_time = dt.strftime('%m/%d %H:%M')
-            patient_options[f"{p['patient_id']} (Last: {formatted_time})"] = p['patient_id']
-        except:
-            patient_options[f"{p['patient_id']} (Last: {last_update})"] = p['patient_id']
-    else:
-        patient_options[f"{p['patient_id']} (No recent data)"] = p['patient_id']
+# Patient selection dropdown (patient ID -> display label)
+patient_options = build_patient_options(patients)
 
-selected_patient_display = st.selectbox("Select Patient", list(patient_options.keys()))
-selected_patient = patient_options[selected_patient_display]
+selected_patient = st.selectbox(
+    "Select Patient",
+    list(patient_options.keys()),
+    format_func=patient_options.get,
+    key='selected_patient'
+)
 
 # Get patient data
-df = get_patient_data(selected_patient, days=30)
+if bundle is None or bundle['patient_id'] != selected_patient:
+    bundle = get_bundle(selected_patient)
+
+if bundle is not None:
+    df = bundle['data']
+    med_history = bundle['medication_history']
+else:
+    # Backend without the bundle endpoint
+    df = get_patient_data(selected_patient, days=30)
+    med_history = get_medication_history(selected_patient)
+
 if df.empty:
     st.warning(f"No data found for patient {selected_patient}")
     st.info("This could mean:")
@@ -296,7 +362,7 @@ with tab1:
         # Walking Speed
         if 'walking_speed' in df_filtered.columns and not df_filtered['walking_speed'].isna().all():
             fig.add_trace(
-                go.Scatter(x=df_filtered['timestamp'], y=df_filtered['walking_speed'], 
+                go.Scattergl(x=df_filtered['timestamp'], y=df_filtered['walking_speed'], 
                           name='Walking Speed', line=dict(color='blue')),
                 row=1, col=1
             )
@@ -305,7 +371,7 @@ with tab1:
         # Asymmetry 
         if 'walking_asymmetry' in df_filtered.columns and not df_filtered['walking_asymmetry'].isna().all():
             fig.add_trace(
-                go.Scatter(x=df_filtered['timestamp'], y=df_filtered['walking_asymmetry'], 
+                go.Scattergl(x=df_filtered['timestamp'], y=df_filtered['walking_asymmetry'], 
                           name='Asymmetry', line=dict(color='orange')),
                 row=1, col=2
             )
@@ -314,7 +380,7 @@ with tab1:
         # Double Support
         if 'double_support_time' in df_filtered.columns and not df_filtered['double_support_time'].isna().all():
             fig.add_trace(
-                go.Scatter(x=df_filtered['timestamp'], y=df_filtered['double_support_time'], 
+                go.Scattergl(x=df_filtered['timestamp'], y=df_filtered['double_support_time'], 
                           name='Double Support', line=dict(color='green')),
                 row=2, col=1
             )
@@ -323,7 +389,7 @@ with tab1:
         # Step Count
         if 'step_count' in df_filtered.columns and not df_filtered['step_count'].isna().all():
             fig.add_trace(
-                go.Scatter(x=df_filtered['timestamp'], y=df_filtered['step_count'], 
+                go.Scattergl(x=df_filtered['timestamp'], y=df_filtered['step_count'], 
                           name='Step Count', line=dict(color='purple')),
                 row=2, col=2
             )
@@ -380,7 +446,6 @@ with tab2:
                     st.error("Please fill in all required fields (Medication Name, Previous Dosage, New Dosage, Pharmacist ID)")
     
     # Display medication history
-    med_history = get_medication_history(selected_patient)
     if not med_history.empty:
         st.subheader("📋 Medication History")
         
@@ -457,11 +522,13 @@ with tab3:
     
     if not df.empty:
         # Check for alerts in recent data
-        alert_data = df[
-            (df.get('asymmetry_alert', False) == True) | 
-            (df.get('double_support_alert', False) == True) |
-            (df.get('walking_speed', 999) < speed_threshold)
-        ].tail(10)
+        mask = alert_mask(
+            column_array(df, 'walking_speed', np.float64, np.inf),
+            column_array(df, 'asymmetry_alert', np.bool_, False),
+            column_array(df, 'double_support_alert', np.bool_, False),
+            speed_threshold
+        )
+        alert_data = df[mask].tail(10)
         
         if not alert_data.empty:
             alert_display = alert_data.copy()
@@ -483,9 +550,6 @@ with tab3:
 with tab4:
     st.subheader("📈 Medication Impact Analysis")
     
-    # Get medication changes for correlation
-    med_history = get_medication_history(selected_patient)
-    
     if not med_history.empty and not df.empty:
         st.write("**Correlation between medication changes and gait metrics:**")
         
@@ -494,7 +558,7 @@ with tab4:
         
         # Plot walking speed over time if available
         if 'walking_speed' in df.columns and not df['walking_speed'].isna().all():
-            fig.add_trace(go.Scatter(
+            fig.add_trace(go.Scattergl(
                 x=df['timestamp'], 
                 y=df['walking_speed'],
                 mode='lines+markers',
@@ -534,28 +598,25 @@ with tab4:
         
         analysis_results = []
         
-        for _, change in med_history.iterrows():
-            change_date = change['change_date']
-            
-            # Get data 7 days before and after the change
-            before_data = df[
-                (df['timestamp'] <= change_date) & 
-                (df['timestamp'] >= change_date - timedelta(days=7))
-            ]
-            after_data = df[
-                (df['timestamp'] > change_date) & 
-                (df['timestamp'] <= change_date + timedelta(days=7))
-            ]
+        if 'walking_speed' in df.columns:
+            # df is sorted by timestamp, so each 7-day window is a pair of binary searches
+            ts = df['timestamp'].to_numpy(dtype='datetime64[ns]')
+            speeds = df['walking_speed'].to_numpy(dtype=float, na_value=np.nan)
+            change_ts = med_history['change_date'].to_numpy(dtype='datetime64[ns]')
+            week = np.timedelta64(7, 'D')
+            window_start = np.searchsorted(ts, change_ts - week, side='left')
+            change_idx = np.searchsorted(ts, change_ts, side='right')
+            window_end = np.searchsorted(ts, change_ts + week, side='right')
             
-            if not before_data.empty and not after_data.empty and 'walking_speed' in df.columns:
-                before_avg = before_data['walking_speed'].mean()
-                after_avg = after_data['walking_speed'].mean()
+            for change, i0, i1, i2 in zip(med_history.to_dict('records'), window_start, change_idx, window_end):
+                before_avg = window_mean(speeds, i0, i1)
+                after_avg = window_mean(speeds, i1, i2)
                 
                 if pd.notna(before_avg) and pd.notna(after_avg):
                     change_pct = ((after_avg - before_avg) / before_avg) * 100 if before_avg != 0 else 0
                     
                     analysis_results.append({
-                        'Date': change_date.strftime('%Y-%m-%d'),
+                        'Date': change['change_date'].strftime('%Y-%m-%d'),
                         'Medication': change['medication_name'],
                         'Change': f"{change['old_dosage']} → {change['new_dosage']}",
                         'Speed Before': f"{before_avg:.2f} m/s",
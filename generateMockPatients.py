@@ -1,10 +1,13 @@
-import random
 import uuid
 from datetime import date, timedelta
 import json
+import numpy as np
+
+rng = np.random.default_rng()
 
 # Medication pools
 MS_MEDS = ["Ocrevus", "Tysabri", "Tecfidera", "Aubagio"]
+MS_MED_INDEX = {drug: i for i, drug in enumerate(MS_MEDS)}
 CHRONIC_MEDS = {
     "hypertension": ["Lisinopril", "Amlodipine", "Metoprolol", "Losartan"],
     "diabetes": ["Metformin", "Jardiance", "Insulin Glargine"],
@@ -13,39 +16,49 @@ CHRONIC_MEDS = {
 }
 CONTROL_MEDS = ["Vitamin D", "Birth Control", "Melatonin", "Ibuprofen"]
 
+# Chance of each comorbidity for non-control patients
+CONDITION_RATES = {
+    "hypertension": 0.5,
+    "diabetes": 0.3,
+    "depression": 0.4,
+    "hyperlipidemia": 0.4
+}
+
 def random_date(start, end):
-    return start + timedelta(days=random.randint(0, (end - start).days))
+    return start + timedelta(days=int(rng.integers(0, (end - start).days, endpoint=True)))
 
 def generate_med_timeline(start_date, conditions, is_control):
     timeline = []
     current_date = start_date
 
     if "ms" in conditions:
-        drug = random.choice(MS_MEDS)
-        timeline.append({"date": current_date, "drug": drug, "action": "start"})
-        for _ in range(random.randint(1, 2)):
-            current_date += timedelta(days=random.randint(15, 25))
-            if random.random() < 0.5:
-                timeline.append({"date": current_date, "drug": drug, "action": "increase dose"})
+        drug = str(rng.choice(MS_MEDS))
+        timeline.append({"date": current_date.isoformat(), "drug": drug, "action": "start"})
+        for _ in range(rng.integers(1, 2, endpoint=True)):
+            current_date += timedelta(days=int(rng.integers(15, 25, endpoint=True)))
+            if rng.random() < 0.5:
+                timeline.append({"date": current_date.isoformat(), "drug": drug, "action": "increase dose"})
             else:
-                new_drug = random.choice([d for d in MS_MEDS if d != drug])
-                timeline.append({"date": current_date, "drug": new_drug, "action": "switch"})
+                # Pick from the other drugs by skipping over the current one's index
+                i = int(rng.integers(0, len(MS_MEDS) - 1))
+                new_drug = MS_MEDS[i if i < MS_MED_INDEX[drug] else i + 1]
+                timeline.append({"date": current_date.isoformat(), "drug": new_drug, "action": "switch"})
                 drug = new_drug
     else:
         # Controls or non-MS: 1-2 low-impact meds
-        for _ in range(random.randint(1, 2)):
+        for _ in range(rng.integers(1, 2, endpoint=True)):
             timeline.append({
-                "date": current_date,
-                "drug": random.choice(CONTROL_MEDS),
+                "date": current_date.isoformat(),
+                "drug": str(rng.choice(CONTROL_MEDS)),
                 "action": "start"
             })
 
     # Add other chronic conditions
     for cond, meds in CHRONIC_MEDS.items():
         if cond in conditions:
-            med = random.choice(meds)
+            med = str(rng.choice(meds))
             timeline.append({
-                "date": current_date,
+                "date": current_date.isoformat(),
                 "drug": med,
                 "action": "start"
             })
@@ -57,13 +70,13 @@ def generate_flare_periods(start_date, has_ms):
         return []
 
     flares = []
-    for _ in range(random.randint(2, 3)):
+    for _ in range(rng.integers(2, 3, endpoint=True)):
         start = random_date(start_date, date(2025, 8, 1))
-        end = start + timedelta(days=random.randint(2, 4))
-        flares.append((start, end))
+        end = start + timedelta(days=int(rng.integers(2, 4, endpoint=True)))
+        flares.append((start.isoformat(), end.isoformat()))
     return flares
 
-def generate_conditions(has_ms, is_control):
+def generate_conditions(has_ms, is_control, condition_flags):
     conditions = []
 
     if has_ms:
@@ -71,39 +84,32 @@ def generate_conditions(has_ms, is_control):
     elif is_control:
         return conditions
 
-    if random.random() < 0.5:
-        conditions.append("hypertension")
-    if random.random() < 0.3:
-        conditions.append("diabetes")
-    if random.random() < 0.4:
-        conditions.append("depression")
-    if random.random() < 0.4:
-        conditions.append("hyperlipidemia")
-
+    conditions.extend(cond for cond, flag in zip(CONDITION_RATES, condition_flags) if flag)
     return conditions
 
 def generate_patients(n=12):
     start_date = date(2025, 5, 1)
     patients = []
 
-    for i in range(n):
-        is_control = i >= n - 2
-        has_ms = not is_control and random.random() < 0.8
-
-        sex = random.choice(["Male", "Female"])
-        height = random.randint(155, 190)
-        weight = random.randint(50, 95)
+    # Draw every patient's demographics and condition flags up front
+    is_control = np.arange(n) >= n - 2
+    has_ms = ~is_control & (rng.random(n) < 0.8)
+    sexes = rng.choice(["Male", "Female"], n)
+    heights = rng.integers(155, 190, n, endpoint=True)
+    weights = rng.integers(50, 95, n, endpoint=True)
+    condition_flags = rng.random((n, len(CONDITION_RATES))) < np.fromiter(CONDITION_RATES.values(), float)
 
-        conditions = generate_conditions(has_ms, is_control)
-        meds = generate_med_timeline(start_date, conditions, is_control)
-        flares = generate_flare_periods(start_date, has_ms)
+    for i in range(n):
+        conditions = generate_conditions(has_ms[i], is_control[i], condition_flags[i])
+        meds = generate_med_timeline(start_date, conditions, is_control[i])
+        flares = generate_flare_periods(start_date, has_ms[i])
 
         patients.append({
             "id": f"patient_{str(i+1).zfill(3)}",
-            "sex": sex,
-            "height_cm": height,
-            "weight_kg": weight,
-            "has_ms": has_ms,
+            "sex": str(sexes[i]),
+            "height_cm": int(heights[i]),
+            "weight_kg": int(weights[i]),
+            "has_ms": bool(has_ms[i]),
             "conditions": conditions,
             "medications": meds,
             "flares": flares
@@ -113,5 +119,6 @@ def generate_patients(n=12):
 
 if __name__ == "__main__":
     patients = generate_patients()
+    # Dates are already ISO strings and indent is left off, so the C encoder does all the work
     with open("mock_patients.json", "w") as f:
-        json.dump(patients, f, indent=2, default=str)
+        json.dump(patients, f)
@@ -1,17 +1,20 @@
 # script: generate_patient_xmls.py
 
+import argparse
 import json
+from functools import partial
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
-import xml.etree.ElementTree as ET
-from datetime import timedelta, datetime
+from numba import njit
+from xml.sax.saxutils import quoteattr
 
 # Corrected METRICS definition
 METRICS = {
-    'HKQuantityTypeIdentifierWalkingSpeed': ('Walking Speed (m/s)', 0.8, 'low'),
-    'HKQuantityTypeIdentifierStepLength': ('Step Length (m)', 0.6, 'low'),
-    'HKQuantityTypeIdentifierWalkingAsymmetryPercentage': ('Walking Asymmetry (%)', 10, 'high'),
-    'HKQuantityTypeIdentifierWalkingDoubleSupportPercentage': ('Double Support Time (%)', 30, 'high'),
+    'HKQuantityTypeIdentifierWalkingSpeed': ('Walking Speed (m/s)', 0.8, 'low', 'm/s'),
+    'HKQuantityTypeIdentifierStepLength': ('Step Length (m)', 0.6, 'low', 'm'),
+    'HKQuantityTypeIdentifierWalkingAsymmetryPercentage': ('Walking Asymmetry (%)', 10, 'high', 'count'),
+    'HKQuantityTypeIdentifierWalkingDoubleSupportPercentage': ('Double Support Time (%)', 30, 'high', 'count'),
 }
 
 BASE_SPEED = {
@@ -28,38 +31,52 @@ STEP_LENGTH_BASE = {
 }
 SD_STEP = 0.05
 
-def simulate_series(start, end, baseline, sd, flares, med_timeline, direction="low"):
-    dates = pd.date_range(start, end)
-    values = []
-
-    # Convert flare periods to datetime.date
-    flare_ranges = []
-    for fs, fe in flares:
-        fs_date = pd.to_datetime(fs).date()
-        fe_date = pd.to_datetime(fe).date()
-        flare_ranges.append((fs_date, fe_date))
-
-    for d in dates:
-        val = np.random.normal(baseline, sd)
-        for fs, fe in flare_ranges:
-            if fs <= d.date() <= fe:
-                days = (d.date() - fs).days
-                drop = sd * (2 - 0.3 * days)
-                val -= max(drop, sd * 0.3)
-        for ev in med_timeline:
-            evd = pd.to_datetime(ev["date"]).date()
-            if evd <= d.date() <= evd + timedelta(days=4):
-                if direction == "low":
-                    val += sd * 0.4
-                else:
-                    val -= sd * 0.4
-        values.append(max(val, 0.2))
-    return pd.DataFrame({"Date": dates, "Value": values})
-
-
-def write_xml(patient, start, end, outfolder="outputs"):
-    root = ET.Element("HealthData")
+rng = np.random.default_rng()
+
+
+def _init_worker():
+    # Forked workers inherit the parent's generator state, so give each a fresh stream
+    global rng
+    rng = np.random.default_rng()
+
+@njit(fastmath=True, cache=True)
+def _apply_adjustments(values, day_ints, flare_starts, flare_ends, med_days, sd, direction_sign):
+    # One fused pass per day; single-threaded, since each Pool worker already has a core to itself
+    for i in range(len(values)):
+        v = values[i]
+        day = day_ints[i]
+
+        # Flares: a drop that eases off day by day, but never below 0.3 sd
+        for j in range(len(flare_starts)):
+            if flare_starts[j] <= day <= flare_ends[j]:
+                drop = sd * (2 - 0.3 * (day - flare_starts[j]))
+                v -= drop if drop > sd * 0.3 else sd * 0.3
+
+        # Medication events: a 5-day improvement in the metric's healthy direction
+        for j in range(len(med_days)):
+            if med_days[j] <= day <= med_days[j] + 4:
+                v += direction_sign * sd * 0.4
+
+        values[i] = v if v > 0.2 else 0.2
+    return values
+
+
+def simulate_series(noise, day_ints, baseline, sd, flare_starts, flare_ends, med_days, direction="low"):
+    values = baseline + sd * noise
+    direction_sign = 1.0 if direction == "low" else -1.0
+    return _apply_adjustments(values, day_ints, flare_starts, flare_ends, med_days, sd, direction_sign)
+
+
+def _emit_metric(buf, metric, unit, noise, baseline, sd, direction, day_ints, flare_starts, flare_ends, med_days, start_strs, end_strs):
+    values = simulate_series(noise, day_ints, baseline, sd, flare_starts, flare_ends, med_days, direction)
 
+    template = (f'<Record type="{metric}" unit="{unit}" value="%.3f" startDate="%s" endDate="%s" '
+                f'sourceName="Simulated" sourceVersion="1.0"/>\n').encode()
+    for value, start_str, end_str in zip(values.tolist(), start_strs, end_strs):
+        buf += template % (value, start_str, end_str)
+
+
+def _write_records(buf, patient, day_ints, start_strs, end_strs):
     if patient["has_ms"]:
         speed_baseline = BASE_SPEED["ms"]
         step_baseline = STEP_LENGTH_BASE["ms"]
@@ -70,46 +87,78 @@ def write_xml(patient, start, end, outfolder="outputs"):
         speed_baseline = BASE_SPEED["healthy"]
         step_baseline = STEP_LENGTH_BASE["healthy"]
 
-    # Simulate each metric
-    for metric, (label, default_value, direction) in METRICS.items():
-        if metric == "HKQuantityTypeIdentifierWalkingSpeed":
-            baseline = speed_baseline
-            sd = SD_SPEED
-        elif metric == "HKQuantityTypeIdentifierStepLength":
-            baseline = step_baseline
-            sd = SD_STEP
-        else:
-            # Use a constant baseline for other metrics
-            baseline = default_value
-            sd = default_value * 0.1
-
-        df = simulate_series(start, end, baseline, sd, patient["flares"], patient["medications"], direction)
-
-        for _, row in df.iterrows():
-            rec = ET.SubElement(root, "Record")
-            rec.set("type", metric)
-            rec.set("unit", "count" if "%" in label else "m/s" if "Speed" in label else "m")
-            rec.set("value", f"{row['Value']:.3f}")
-            dt = row["Date"]
-            rec.set("startDate", dt.strftime("%Y-%m-%dT09:00:00-0500"))
-            rec.set("endDate", dt.strftime("%Y-%m-%dT09:05:00-0500"))
-            rec.set("sourceName", "Simulated")
-            rec.set("sourceVersion", "1.0")
-
-    tree = ET.ElementTree(root)
+    # Flare and medication dates as day numbers, converted once per patient
+    flare_starts = np.array([fs for fs, _ in patient["flares"]], dtype="datetime64[D]").astype(np.int64)
+    flare_ends = np.array([fe for _, fe in patient["flares"]], dtype="datetime64[D]").astype(np.int64)
+    med_days = np.array([ev["date"] for ev in patient["medications"]], dtype="datetime64[D]").astype(np.int64)
+    events = (day_ints, flare_starts, flare_ends, med_days, start_strs, end_strs)
+
+    # Standard-normal noise for all four metrics in one draw; each row is scaled by its metric's sd
+    noise = rng.standard_normal((4, len(day_ints)))
+
+    # One call per metric in METRICS order; the percentage metrics use their METRICS default as baseline
+    _emit_metric(buf, "HKQuantityTypeIdentifierWalkingSpeed", "m/s", noise[0], speed_baseline, SD_SPEED, "low", *events)
+    _emit_metric(buf, "HKQuantityTypeIdentifierStepLength", "m", noise[1], step_baseline, SD_STEP, "low", *events)
+    _emit_metric(buf, "HKQuantityTypeIdentifierWalkingAsymmetryPercentage", "count", noise[2], 10, 1.0, "high", *events)
+    _emit_metric(buf, "HKQuantityTypeIdentifierWalkingDoubleSupportPercentage", "count", noise[3], 30, 3.0, "high", *events)
+
+
+def write_xml(patient, day_ints, start_strs, end_strs, outfolder="outputs"):
+    # Every Record has the same shape, so each metric's lines are filled in from a
+    # preformatted bytes template instead of going through an XML tree.
+    # All interpolated values are numbers or fixed timestamps, so nothing needs escaping.
     fname = f"{outfolder}/{patient['id']}.xml"
-    tree.write(fname, encoding="utf-8", xml_declaration=True)
+    # The whole document is assembled in memory and written with a single call
+    buf = bytearray(b"<?xml version='1.0' encoding='utf-8'?>\n<HealthData>\n")
+    _write_records(buf, patient, day_ints, start_strs, end_strs)
+    buf += b"</HealthData>\n"
+    with open(fname, "wb") as fh:
+        fh.write(buf)
+
+
+def write_batch(batch, day_ints, start_strs, end_strs, outfolder="outputs"):
+    # Several patients in one file, each under its own <Patient> element
+    batch_no, patients = batch
+    fname = f"{outfolder}/batch_{str(batch_no).zfill(3)}.xml"
+    buf = bytearray(b"<?xml version='1.0' encoding='utf-8'?>\n<HealthDataBatch>\n")
+    for patient in patients:
+        buf += f"<Patient id={quoteattr(patient['id'])}>\n".encode()
+        _write_records(buf, patient, day_ints, start_strs, end_strs)
+        buf += b"</Patient>\n"
+    buf += b"</HealthDataBatch>\n"
+    with open(fname, "wb") as fh:
+        fh.write(buf)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate simulated Apple Health XML exports for the mock patients")
+    parser.add_argument("--chunk-size", type=int, default=0,
+                        help="patients per batch file; 0 (default) writes one HealthData file per patient")
+    args = parser.parse_args()
+
     with open("mock_patients.json") as f:
         pats = json.load(f)
 
     start = pd.to_datetime("2025-05-01")
     end = pd.to_datetime("2025-08-01")
 
-    for p in pats:
-        write_xml(p, start, end)
+    # Every patient and metric covers the same days, so build the grid once
+    dates = pd.date_range(start, end)
+    day_ints = dates.values.astype("datetime64[D]").astype(np.int64)
+    start_strs = [s.encode() for s in dates.strftime("%Y-%m-%dT09:00:00-0500")]
+    end_strs = [s.encode() for s in dates.strftime("%Y-%m-%dT09:05:00-0500")]
+
+    if args.chunk_size > 0:
+        jobs = list(enumerate(pats[i:i + args.chunk_size] for i in range(0, len(pats), args.chunk_size)))
+        writer = write_batch
+    else:
+        jobs = pats
+        writer = write_xml
+
+    # Each output file is independent, so spread them across cores
+    with Pool(initializer=_init_worker) as pool:
+        for _ in pool.imap_unordered(partial(writer, day_ints=day_ints, start_strs=start_strs, end_strs=end_strs), jobs):
+            pass
 
 if __name__ == "__main__":
     main()
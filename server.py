@@ -1,13 +1,20 @@
 # server.py - FastAPI Backend Optimized for Render Deployment
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 import asyncio
+from collections import OrderedDict
+import functools
 import json
+import orjson
 import os
-import psycopg2
-from sqlalchemy import create_engine, text
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+import time
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import column, insert, table, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, List, Dict, Any, Optional
 import pandas as pd
 import uuid
 from contextlib import asynccontextmanager
@@ -16,21 +23,184 @@ from contextlib import asynccontextmanager
 DATABASE_URL = os.getenv('DATABASE_URL')
 if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+if DATABASE_URL and DATABASE_URL.startswith('postgresql://'):
+    # asyncpg driver so queries don't block the event loop
+    DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
 
 PORT = int(os.getenv('PORT', 8000))
 
-def init_postgres_db():
+# Rows per multi-row INSERT when storing historical batches
+BULK_INSERT_CHUNK = 1000
+# Historical batches larger than this are loaded with COPY instead
+COPY_THRESHOLD = 5000
+
+# Outbound messages buffered per pharmacist before the oldest are dropped
+PHARMACIST_QUEUE_SIZE = 1000
+
+# Thresholds rarely change, so they are cached per patient for a few minutes
+THRESHOLD_CACHE_TTL = 300
+_threshold_cache: Dict[str, tuple] = {}
+# Bumped on every threshold update; a read that started before the bump is not cached
+_threshold_generation: Dict[str, int] = {}
+
+# /health runs a real SELECT 1 at most this often and reports the last result in between
+HEALTH_PROBE_INTERVAL = 10
+HEALTH_PROBE_TIMEOUT = 2
+# ok stays None until the first probe completes
+_health_probe = {'ok': None, 'checked_at': None}
+
+DB_POOL_SIZE = 20
+DB_MAX_OVERFLOW = 10
+# Connections opened at startup so the first requests skip the connect handshake
+DB_POOL_WARM = 10
+
+# One pooled engine for the whole process instead of a new pool (and TCP/SSL handshake) per call
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={'prepared_statement_cache_size': 512}
+) if DATABASE_URL else None
+
+def utc_now() -> datetime:
+    """Current UTC time without an offset, comparable with stored gait timestamps"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def parse_timestamp(value):
+    """Parse ISO timestamp strings for TIMESTAMP columns (asyncpg only binds datetimes)"""
+    # Drop any UTC offset, as Postgres did when casting the string to TIMESTAMP
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return value
+
+# Insertable gait_records columns, shared by the single-row and bulk insert paths
+GAIT_COLUMNS = (
+    'patient_id', 'timestamp', 'walking_speed', 'step_length',
+    'walking_asymmetry', 'double_support_time', 'step_count',
+    'step_cadence', 'six_minute_walk_distance', 'speed_category',
+    'asymmetry_alert', 'double_support_alert', 'data_type'
+)
+gait_records = table('gait_records', column('id'), *(column(name) for name in GAIT_COLUMNS))
+
+# Largest magnitude a DECIMAL(10,4) column holds
+DECIMAL_MAX = 999999.9999
+# Optional measurement that fits a DECIMAL(10,4) column
+Measurement = Annotated[Optional[float], Field(ge=-DECIMAL_MAX, le=DECIMAL_MAX)]
+
+class GaitRecord(BaseModel):
+    """Incoming gait measurement, validated against the gait_records column limits before it reaches the database"""
+    patient_id: str = Field(min_length=1, max_length=50)
+    timestamp: datetime
+    walking_speed: Measurement = None
+    step_length: Measurement = None
+    walking_asymmetry: Measurement = None
+    double_support_time: Measurement = None
+    step_count: Optional[int] = Field(default=None, ge=-2**31, le=2**31 - 1)
+    step_cadence: Measurement = None
+    six_minute_walk_distance: Measurement = None
+    speed_category: Optional[str] = Field(default=None, max_length=50)
+    asymmetry_alert: bool = False
+    double_support_alert: bool = False
+    data_type: str = Field(default='real_time', max_length=20)
+
+def gait_row(data: dict) -> dict:
+    """Map an incoming gait payload onto gait_records column values"""
+    row = {name: data.get(name) for name in GAIT_COLUMNS}
+    row['timestamp'] = parse_timestamp(row['timestamp'])
+    row['asymmetry_alert'] = data.get('asymmetry_alert', False)
+    row['double_support_alert'] = data.get('double_support_alert', False)
+    row['data_type'] = data.get('data_type', 'real_time')
+    return row
+
+# Statements are built once at import; asyncpg keeps their server-side prepared statements cached per connection
+INSERT_GAIT_WITH_THRESHOLDS = text("""
+    WITH t AS (
+        SELECT walking_speed_threshold, asymmetry_threshold, double_support_threshold
+        FROM patient_thresholds
+        WHERE patient_id = :patient_id
+    )
+    INSERT INTO gait_records (
+        patient_id, timestamp, walking_speed, step_length,
+        walking_asymmetry, double_support_time, step_count,
+        step_cadence, six_minute_walk_distance, speed_category,
+        asymmetry_alert, double_support_alert, data_type
+    ) VALUES (
+        :patient_id, :timestamp, :walking_speed, :step_length,
+        :walking_asymmetry, :double_support_time, :step_count,
+        :step_cadence, :six_minute_walk_distance, :speed_category,
+        :asymmetry_alert, :double_support_alert, :data_type
+    ) RETURNING id,
+        (SELECT walking_speed_threshold FROM t),
+        (SELECT asymmetry_threshold FROM t),
+        (SELECT double_support_threshold FROM t)
+""")
+INSERT_GAIT = text("""
+    INSERT INTO gait_records (
+        patient_id, timestamp, walking_speed, step_length,
+        walking_asymmetry, double_support_time, step_count,
+        step_cadence, six_minute_walk_distance, speed_category,
+        asymmetry_alert, double_support_alert, data_type
+    ) VALUES (
+        :patient_id, :timestamp, :walking_speed, :step_length,
+        :walking_asymmetry, :double_support_time, :step_count,
+        :step_cadence, :six_minute_walk_distance, :speed_category,
+        :asymmetry_alert, :double_support_alert, :data_type
+    ) RETURNING id
+""")
+SELECT_THRESHOLDS = text("""
+    SELECT walking_speed_threshold, asymmetry_threshold, double_support_threshold
+    FROM patient_thresholds 
+    WHERE patient_id = :patient_id
+""")
+SELECT_ONE = text("SELECT 1")
+INSERT_MEDICATION_CHANGE = text("""
+    INSERT INTO medication_changes (
+        patient_id, change_date, medication_name,
+        old_dosage, new_dosage, reason, pharmacist_id
+    ) VALUES (
+        :patient_id, :change_date, :medication_name,
+        :old_dosage, :new_dosage, :reason, :pharmacist_id
+    ) RETURNING id
+""")
+SELECT_MEDICATION_HISTORY = text("""
+    SELECT to_json(m) FROM medication_changes m
+    WHERE patient_id = :patient_id
+    ORDER BY change_date DESC
+    LIMIT 100
+""")
+UPSERT_THRESHOLDS = text("""
+    INSERT INTO patient_thresholds (
+        patient_id, walking_speed_threshold, asymmetry_threshold, double_support_threshold
+    ) VALUES (
+        :patient_id, :speed_threshold, :asymmetry_threshold, :support_threshold
+    )
+    ON CONFLICT (patient_id) 
+    DO UPDATE SET
+        walking_speed_threshold = EXCLUDED.walking_speed_threshold,
+        asymmetry_threshold = EXCLUDED.asymmetry_threshold,
+        double_support_threshold = EXCLUDED.double_support_threshold,
+        updated_at = CURRENT_TIMESTAMP
+""")
+SELECT_THRESHOLDS_WITH_UPDATED = text("""
+    SELECT walking_speed_threshold, asymmetry_threshold, double_support_threshold, updated_at
+    FROM patient_thresholds 
+    WHERE patient_id = :patient_id
+""")
+
+async def init_postgres_db():
     """Initialize PostgreSQL database for Render"""
     if not DATABASE_URL:
         print("WARNING: No DATABASE_URL found. Database features will be disabled.")
         return
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
+        async with engine.begin() as conn:
             # Create gait_records table
-            conn.execute(text("""
+            await conn.execute(text("""
                 CREATE TABLE IF NOT EXISTS gait_records (
                     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
                     patient_id VARCHAR(50) NOT NULL,
@@ -51,13 +221,28 @@ def init_postgres_db():
             """))
             
             # Create indexes for better performance
-            conn.execute(text("""
+            await conn.execute(text("""
                 CREATE INDEX IF NOT EXISTS idx_patient_timestamp 
                 ON gait_records(patient_id, timestamp DESC)
             """))
             
+            # Global recent-window scans (stats counts). Rows arrive roughly in time order, so a BRIN
+            # index prunes ranges for a fraction of the size of the btree it replaces
+            await conn.execute(text("DROP INDEX IF EXISTS idx_gait_timestamp"))
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_gait_timestamp_brin
+                ON gait_records USING BRIN(timestamp) WITH (pages_per_range = 32)
+            """))
+            
+            # Only alerting rows, matching the /api/alerts/recent filter
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_gait_alerts
+                ON gait_records(timestamp DESC)
+                WHERE asymmetry_alert = true OR double_support_alert = true OR walking_speed < 0.8
+            """))
+            
             # Create medication_changes table
-            conn.execute(text("""
+            await conn.execute(text("""
                 CREATE TABLE IF NOT EXISTS medication_changes (
                     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
                     patient_id VARCHAR(50) NOT NULL,
@@ -71,8 +256,13 @@ def init_postgres_db():
                 )
             """))
             
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_medication_patient_date
+                ON medication_changes(patient_id, change_date DESC)
+            """))
+            
             # Create patient_thresholds table
-            conn.execute(text("""
+            await conn.execute(text("""
                 CREATE TABLE IF NOT EXISTS patient_thresholds (
                     patient_id VARCHAR(50) PRIMARY KEY,
                     walking_speed_threshold DECIMAL(10,4) DEFAULT 0.8,
@@ -82,17 +272,35 @@ def init_postgres_db():
                 )
             """))
             
-            conn.commit()
             print("Database tables initialized successfully")
             
     except Exception as e:
         print(f"Database initialization error: {e}")
 
+async def warm_connection_pool():
+    """Open DB_POOL_WARM pooled connections up front so they sit idle in the pool"""
+    if not DATABASE_URL:
+        return
+    
+    async def warm():
+        async with engine.connect() as conn:
+            await conn.execute(SELECT_ONE)
+    
+    try:
+        # Held concurrently, so each one is a separate connection
+        await asyncio.gather(*(warm() for _ in range(DB_POOL_WARM)))
+        print(f"Warmed {DB_POOL_WARM} database connections")
+    except Exception as e:
+        print(f"Connection pool warm-up error: {e}")
+
 # Connection manager for WebSocket clients
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
-        self.pharmacist_connections: List[WebSocket] = []
+        # Each pharmacist gets a bounded queue of serialized messages drained by its own
+        # writer task, so a slow socket never holds up the other pharmacists or the patient loops
+        self.pharmacist_connections: Dict[WebSocket, asyncio.Queue] = {}
+        self.pharmacist_writers: Dict[WebSocket, asyncio.Task] = {}
 
     async def connect_patient(self, websocket: WebSocket, patient_id: str):
         await websocket.accept()
@@ -101,7 +309,8 @@ class ConnectionManager:
 
     async def connect_pharmacist(self, websocket: WebSocket):
         await websocket.accept()
-        self.pharmacist_connections.append(websocket)
+        self.pharmacist_connections[websocket] = asyncio.Queue(maxsize=PHARMACIST_QUEUE_SIZE)
+        self.pharmacist_writers[websocket] = asyncio.create_task(self._pharmacist_writer(websocket))
         print("Pharmacist connected to alert stream")
 
     def disconnect_patient(self, patient_id: str):
@@ -111,43 +320,111 @@ class ConnectionManager:
 
     def disconnect_pharmacist(self, websocket: WebSocket):
         if websocket in self.pharmacist_connections:
-            self.pharmacist_connections.remove(websocket)
+            del self.pharmacist_connections[websocket]
+            writer = self.pharmacist_writers.pop(websocket, None)
+            if writer is not None and writer is not asyncio.current_task():
+                writer.cancel()
             print("Pharmacist disconnected from alert stream")
 
-    async def notify_pharmacists(self, message: dict):
-        """Notify all connected pharmacists of alerts"""
-        if not self.pharmacist_connections:
+    async def _pharmacist_writer(self, websocket: WebSocket):
+        """Send a pharmacist's queued messages in order until the socket fails"""
+        queue = self.pharmacist_connections[websocket]
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Failed to send message to pharmacist: {e}")
+            self.disconnect_pharmacist(websocket)
+
+    def send_to_pharmacist(self, websocket: WebSocket, message: dict):
+        """Queue a message for one pharmacist"""
+        self._enqueue(websocket, orjson.dumps(message).decode())
+
+    def _enqueue(self, websocket: WebSocket, payload: str):
+        """Queue serialized JSON for one pharmacist, dropping the oldest if they have fallen behind"""
+        queue = self.pharmacist_connections.get(websocket)
+        if queue is None:
+            return
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+    async def notify_pharmacists(self, alerts: List[dict]):
+        """Notify all connected pharmacists of alerts, coalescing several into one frame"""
+        if not alerts or not self.pharmacist_connections:
             return
             
-        dead_connections = []
-        for connection in self.pharmacist_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Failed to send message to pharmacist: {e}")
-                dead_connections.append(connection)
+        if len(alerts) == 1:
+            message = alerts[0]
+        else:
+            message = {
+                "type": "alerts_batch",
+                "alerts": alerts,
+                "timestamp": datetime.now().isoformat()
+            }
         
-        # Clean up dead connections
-        for dead in dead_connections:
-            self.pharmacist_connections.remove(dead)
+        # Serialize once and share the same text across every pharmacist
+        payload = orjson.dumps(message).decode()
+        for websocket in list(self.pharmacist_connections):
+            self._enqueue(websocket, payload)
 
 manager = ConnectionManager()
 
+def ttl_cache(seconds: float, maxsize: int = 16):
+    """Cache an async endpoint's result per argument set for a few seconds, keeping at most maxsize entries"""
+    def decorator(func):
+        # Keys come from query parameters, so the cache is bounded and least recently used entries go first
+        cache: OrderedDict = OrderedDict()
+        lock = asyncio.Lock()
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            entry = cache.get(key)
+            if entry and time.monotonic() - entry[1] < seconds:
+                cache.move_to_end(key)
+                return entry[0]
+            
+            # Only one caller refreshes an expired entry; the rest wait and reuse its result
+            async with lock:
+                entry = cache.get(key)
+                if entry and time.monotonic() - entry[1] < seconds:
+                    return entry[0]
+                value = await func(*args, **kwargs)
+                now = time.monotonic()
+                for stale in [k for k, (_, stored_at) in cache.items() if now - stored_at >= seconds]:
+                    del cache[stale]
+                cache[key] = (value, now)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+                return value
+        
+        return wrapper
+    return decorator
+
 # Application lifecycle
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize database on startup
     print("Starting up: Initializing database...")
-    init_postgres_db()
+    await init_postgres_db()
+    await warm_connection_pool()
     yield
     # Cleanup on shutdown
     print("Shutting down...")
+    if engine is not None:
+        await engine.dispose()
 
 # FastAPI app
 app = FastAPI(
     title="Gait Monitoring API", 
     version="1.0.0",
     description="Real-time gait monitoring for MS/Parkinson's patients",
+    default_response_class=ORJSONResponse,  # orjson encodes the row-heavy responses much faster than json
     lifespan=lifespan
 )
 
@@ -160,45 +437,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def store_gait_data(data: dict):
+def _cached_thresholds(patient_id: str) -> Optional[dict]:
+    """Return a patient's cached thresholds if they are still fresh"""
+    cached = _threshold_cache.get(patient_id)
+    if cached and time.monotonic() - cached[1] < THRESHOLD_CACHE_TTL:
+        return cached[0]
+    return None
+
+def _cache_thresholds(patient_id: str, row, generation: int) -> dict:
+    """Cache thresholds from a patient_thresholds row, or the defaults when there is none"""
+    if row is not None and row[0] is not None:
+        thresholds = {
+            'speed': float(row[0]),
+            'asymmetry': float(row[1]),
+            'double_support': float(row[2])
+        }
+    else:
+        thresholds = {'speed': 0.8, 'asymmetry': 10.0, 'double_support': 30.0}
+    
+    # An update committed while this row was being read, so it may already be stale
+    if _threshold_generation.get(patient_id, 0) == generation:
+        _threshold_cache[patient_id] = (thresholds, time.monotonic())
+    return thresholds
+
+async def store_gait_data(data: dict):
     """Store gait data in PostgreSQL database"""
     if not DATABASE_URL:
         print("No database connection available")
         return None
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                INSERT INTO gait_records (
-                    patient_id, timestamp, walking_speed, step_length,
-                    walking_asymmetry, double_support_time, step_count,
-                    step_cadence, six_minute_walk_distance, speed_category,
-                    asymmetry_alert, double_support_alert, data_type
-                ) VALUES (
-                    :patient_id, :timestamp, :walking_speed, :step_length,
-                    :walking_asymmetry, :double_support_time, :step_count,
-                    :step_cadence, :six_minute_walk_distance, :speed_category,
-                    :asymmetry_alert, :double_support_alert, :data_type
-                ) RETURNING id
-            """), {
-                'patient_id': data.get('patient_id'),
-                'timestamp': data.get('timestamp'),
-                'walking_speed': data.get('walking_speed'),
-                'step_length': data.get('step_length'),
-                'walking_asymmetry': data.get('walking_asymmetry'),
-                'double_support_time': data.get('double_support_time'),
-                'step_count': data.get('step_count'),
-                'step_cadence': data.get('step_cadence'),
-                'six_minute_walk_distance': data.get('six_minute_walk_distance'),
-                'speed_category': data.get('speed_category'),
-                'asymmetry_alert': data.get('asymmetry_alert', False),
-                'double_support_alert': data.get('double_support_alert', False),
-                'data_type': data.get('data_type', 'real_time')
-            })
+        async with engine.begin() as conn:
+            if _cached_thresholds(data.get('patient_id')) is None:
+                # Fetch the patient's thresholds in the same round trip so the alert check that follows hits the cache
+                generation = _threshold_generation.get(data.get('patient_id'), 0)
+                result = await conn.execute(INSERT_GAIT_WITH_THRESHOLDS, gait_row(data))
+                
+                row = result.fetchone()
+                _cache_thresholds(data.get('patient_id'), row[1:], generation)
+                print(f"Stored gait data for patient {data.get('patient_id')}")
+                return str(row[0])
+            
+            result = await conn.execute(INSERT_GAIT, gait_row(data))
             
-            conn.commit()
             record_id = result.fetchone()[0]
             print(f"Stored gait data for patient {data.get('patient_id')}")
             return str(record_id)
@@ -207,14 +488,86 @@ def store_gait_data(data: dict):
         print(f"Database error storing gait data: {e}")
         return None
 
-def check_for_alerts(data: dict) -> List[dict]:
+async def store_gait_data_bulk(records: List[dict]) -> int:
+    """Store a batch of gait records, returning how many rows were written"""
+    if not DATABASE_URL:
+        print("No database connection available")
+        return 0
+    if not records:
+        return 0
+        
+    try:
+        async with engine.begin() as conn:
+            if len(records) > COPY_THRESHOLD:
+                # Very large uploads go through COPY on the underlying asyncpg connection
+                raw_conn = await conn.get_raw_connection()
+                await raw_conn.driver_connection.copy_records_to_table(
+                    'gait_records',
+                    records=[tuple(gait_row(record).values()) for record in records],
+                    columns=GAIT_COLUMNS
+                )
+            else:
+                # Otherwise one multi-row INSERT per chunk
+                for start in range(0, len(records), BULK_INSERT_CHUNK):
+                    rows = [gait_row(record) for record in records[start:start + BULK_INSERT_CHUNK]]
+                    await conn.execute(insert(gait_records).values(rows))
+            
+        print(f"Stored {len(records)} historical gait records")
+        return len(records)
+            
+    except Exception as e:
+        print(f"Database error storing gait data batch: {e}")
+        return 0
+
+async def check_for_alerts(data: dict) -> List[dict]:
     """Check if gait data indicates potential flare"""
+    # Get patient-specific thresholds or use defaults
+    thresholds = await get_patient_thresholds(data.get('patient_id'))
+    return build_alerts(data, thresholds)
+
+async def check_for_alerts_bulk(records: List[dict]) -> List[dict]:
+    """Check a historical batch for flare alerts, comparing whole columns at once"""
+    if not records:
+        return []
+    
+    patient_ids = {record.get('patient_id') for record in records}
+    thresholds = {patient_id: await get_patient_thresholds(patient_id) for patient_id in patient_ids}
+    
+    # Evaluating thousands of rows is CPU work, so it runs in a worker thread off the event loop
+    return await run_in_threadpool(evaluate_alerts, records, thresholds)
+
+def evaluate_alerts(records: List[dict], thresholds: Dict[str, dict]) -> List[dict]:
+    """Build the alerts for a batch given each patient's thresholds"""
+    df = pd.DataFrame(records, columns=['patient_id', 'walking_speed', 'walking_asymmetry', 'double_support_time'])
+    
+    def column_values(name):
+        return df[name].astype(float).to_numpy()
+    
+    def threshold_values(key):
+        return df['patient_id'].map({pid: t[key] for pid, t in thresholds.items()}).astype(float).to_numpy()
+    
+    # Missing or zero readings never alert, matching the truthiness checks in build_alerts
+    speed = column_values('walking_speed')
+    asymmetry = column_values('walking_asymmetry')
+    double_support = column_values('double_support_time')
+    flagged = (
+        ((speed != 0) & (speed < threshold_values('speed'))) |
+        ((asymmetry != 0) & (asymmetry > threshold_values('asymmetry'))) |
+        ((double_support != 0) & (double_support > threshold_values('double_support')))
+    )
+    
+    # Only flagged rows go through the per-record message building
+    alerts = []
+    for i in flagged.nonzero()[0]:
+        record = records[i]
+        alerts.extend(build_alerts(record, thresholds[record.get('patient_id')]))
+    return alerts
+
+def build_alerts(data: dict, thresholds: dict) -> List[dict]:
+    """Build the alerts a single gait record raises against the given thresholds"""
     alerts = []
     patient_id = data.get('patient_id')
     
-    # Get patient-specific thresholds or use defaults
-    thresholds = get_patient_thresholds(patient_id)
-    
     # Check for alerts based on thresholds
     if data.get('walking_speed') and data['walking_speed'] < thresholds['speed']:
         alerts.append({
@@ -248,54 +601,67 @@ def check_for_alerts(data: dict) -> List[dict]:
     
     return alerts
 
-def get_patient_thresholds(patient_id: str) -> dict:
+async def get_patient_thresholds(patient_id: str) -> dict:
     """Get patient-specific thresholds or defaults"""
     if not DATABASE_URL:
         return {'speed': 0.8, 'asymmetry': 10.0, 'double_support': 30.0}
     
+    cached = _cached_thresholds(patient_id)
+    if cached:
+        return cached
+    
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT walking_speed_threshold, asymmetry_threshold, double_support_threshold
-                FROM patient_thresholds 
-                WHERE patient_id = :patient_id
-            """), {'patient_id': patient_id})
+        generation = _threshold_generation.get(patient_id, 0)
+        async with engine.connect() as conn:
+            result = await conn.execute(SELECT_THRESHOLDS, {'patient_id': patient_id})
             
-            row = result.fetchone()
-            if row:
-                return {
-                    'speed': float(row[0]),
-                    'asymmetry': float(row[1]),
-                    'double_support': float(row[2])
-                }
-            else:
-                # Return defaults
-                return {'speed': 0.8, 'asymmetry': 10.0, 'double_support': 30.0}
+            # Falls back to the defaults when the patient has no row
+            return _cache_thresholds(patient_id, result.fetchone(), generation)
                 
     except Exception as e:
         print(f"Error getting patient thresholds: {e}")
         return {'speed': 0.8, 'asymmetry': 10.0, 'double_support': 30.0}
 
+async def probe_database():
+    """Run a trivial query on a pooled connection"""
+    async with engine.connect() as conn:
+        await conn.execute(SELECT_ONE)
+
 # Health check endpoint for Render
 @app.get("/health")
 async def health_check():
     """Health check endpoint for monitoring"""
-    db_status = "connected" if DATABASE_URL else "not configured"
+    if not DATABASE_URL:
+        return {
+            "status": "healthy",
+            "database": "not configured",
+            "active_patients": len(manager.active_connections),
+            "active_pharmacists": len(manager.pharmacist_connections)
+        }
     
-    if DATABASE_URL:
-        try:
-            engine = create_engine(DATABASE_URL)
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            db_status = "connected"
-        except:
-            db_status = "connection failed"
+    pool = engine.pool
+    if pool.checkedout() >= DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        # Every pooled and overflow connection is in use; probing would just wait on the pool
+        db_status = "degraded"
+    else:
+        now = time.monotonic()
+        if _health_probe['checked_at'] is None or now - _health_probe['checked_at'] >= HEALTH_PROBE_INTERVAL:
+            _health_probe['checked_at'] = now
+            try:
+                await asyncio.wait_for(probe_database(), timeout=HEALTH_PROBE_TIMEOUT)
+                _health_probe['ok'] = True
+            except Exception:
+                _health_probe['ok'] = False
+        
+        if _health_probe['ok'] is None:
+            db_status = "unknown"  # First probe still in flight
+        else:
+            db_status = "ok" if _health_probe['ok'] else "down"
     
     return {
         "status": "healthy",
         "database": db_status,
+        "pool": pool.status(),
         "active_patients": len(manager.active_connections),
         "active_pharmacists": len(manager.pharmacist_connections)
     }
@@ -312,29 +678,42 @@ async def websocket_endpoint(websocket: WebSocket, patient_id: str):
             
             # Store in database
             if data.get('data_type') == 'historical':
-                # Handle batch historical data
-                for record in data.get('records', []):
-                    record_id = store_gait_data(record)
-                    if record_id:
-                        alerts = check_for_alerts(record)
-                        if alerts:
-                            for alert in alerts:
-                                await manager.notify_pharmacists(alert)
+                # Handle batch historical data in one bulk insert, then check alerts once it has committed
+                records = []
+                for raw_record in data.get('records', []):
+                    try:
+                        records.append(GaitRecord.model_validate(raw_record).model_dump())
+                    except ValidationError:
+                        pass  # Malformed records are skipped rather than failing the whole batch
+                
+                # The batch is one transaction, so either every valid record is stored or none is
+                stored = await store_gait_data_bulk(records)
+                if stored:
+                    await manager.notify_pharmacists(await check_for_alerts_bulk(records))
                 
                 await websocket.send_json({
-                    "status": "batch_received",
-                    "records_processed": len(data.get('records', [])),
+                    "status": "batch_received" if stored or not records else "error",
+                    "records_processed": stored,
+                    "records_skipped": len(data.get('records', [])) - stored,
                     "timestamp": datetime.now().isoformat()
                 })
             else:
-                # Handle real-time data
-                record_id = store_gait_data(data)
-                alerts = check_for_alerts(data)
+                # Handle real-time data, rejecting malformed payloads before touching the database
+                try:
+                    data = GaitRecord.model_validate(data).model_dump()
+                except ValidationError as e:
+                    await websocket.send_json({
+                        "status": "invalid",
+                        "errors": e.error_count(),
+                        "timestamp": datetime.now().isoformat()
+                    })
+                    continue
+                
+                record_id = await store_gait_data(data)
+                alerts = await check_for_alerts(data)
                 
                 # Send alerts to pharmacists
-                if alerts:
-                    for alert in alerts:
-                        await manager.notify_pharmacists(alert)
+                await manager.notify_pharmacists(alerts)
                 
                 # Send confirmation back to Swift app
                 await websocket.send_json({
@@ -357,21 +736,18 @@ async def pharmacist_websocket(websocket: WebSocket):
     
     try:
         # Send initial connection confirmation
-        await websocket.send_json({
+        manager.send_to_pharmacist(websocket, {
             "type": "connection_established",
             "message": "Connected to alert stream",
             "timestamp": datetime.now().isoformat()
         })
         
+        # Liveness is handled by protocol-level pings (ws_ping_interval), so this just waits
+        # for inbound messages, text or binary, which are ignored until the pharmacist disconnects
         while True:
-            # Keep connection alive and handle any pharmacist actions
-            await asyncio.sleep(30)  # Send heartbeat every 30 seconds
-            try:
-                await websocket.send_json({
-                    "type": "heartbeat",
-                    "timestamp": datetime.now().isoformat()
-                })
-            except:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                manager.disconnect_pharmacist(websocket)
                 break
                 
     except WebSocketDisconnect:
@@ -382,14 +758,13 @@ async def pharmacist_websocket(websocket: WebSocket):
 
 # REST API endpoints
 @app.post("/api/gait-data")
-async def receive_gait_data(data: dict):
+async def receive_gait_data(record: GaitRecord):
     """HTTP endpoint as alternative to WebSocket"""
-    record_id = store_gait_data(data)
-    alerts = check_for_alerts(data)
+    data = record.model_dump()
+    record_id = await store_gait_data(data)
+    alerts = await check_for_alerts(data)
     
-    if alerts:
-        for alert in alerts:
-            await manager.notify_pharmacists(alert)
+    await manager.notify_pharmacists(alerts)
     
     return {
         "status": "success", 
@@ -398,76 +773,85 @@ async def receive_gait_data(data: dict):
         "timestamp": datetime.now().isoformat()
     }
 
-@app.get("/api/patient/{patient_id}/data")
-async def get_patient_data(patient_id: str, days: int = 30):
-    """Get patient gait data for analysis"""
-    if not DATABASE_URL:
-        return []
-        
+# Each row comes back as Postgres-rendered JSON text (ISO timestamps, plain numbers)
+PATIENT_DATA_QUERY = text("""
+    SELECT to_json(g)::text FROM gait_records g
+    WHERE patient_id = :patient_id 
+    AND timestamp >= :cutoff
+    ORDER BY timestamp DESC
+    LIMIT 1000
+""")
+
+async def fetch_patient_rows(patient_id: str, days: int = 30) -> List[str]:
+    """Get patient gait data as Postgres-rendered JSON text, one string per row"""
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT * FROM gait_records 
-                WHERE patient_id = :patient_id 
-                AND timestamp >= NOW() - INTERVAL ':days days'
-                ORDER BY timestamp DESC
-                LIMIT 1000
-            """), {'patient_id': patient_id, 'days': days})
-            
-            columns = result.keys()
-            data = [dict(zip(columns, row)) for row in result.fetchall()]
-            
-            # Convert timestamps to strings for JSON serialization
-            for record in data:
-                for key, value in record.items():
-                    if isinstance(value, datetime):
-                        record[key] = value.isoformat()
-            
-            return data
+        async with engine.connect() as conn:
+            result = await conn.execute(PATIENT_DATA_QUERY, {
+                'patient_id': patient_id, 'cutoff': utc_now() - timedelta(days=days)
+            })
+            return [row[0] for row in result]
             
     except Exception as e:
         print(f"Error getting patient data: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
+@app.get("/api/patient/{patient_id}/data")
+async def get_patient_data(patient_id: str, days: int = 30):
+    """Get patient gait data for analysis"""
+    if not DATABASE_URL:
+        return []
+    
+    # The query is capped by its LIMIT, so the rows are fetched up front and the connection goes
+    # back to the pool before any client I/O; being JSON already, they are joined without re-encoding
+    rows = await fetch_patient_rows(patient_id, days)
+    return Response("[" + ",".join(rows) + "]", media_type="application/json")
+
+async def fetch_patient_data(patient_id: str, days: int = 30) -> list:
+    """Get patient gait data as a list, for responses that embed it"""
+    if not DATABASE_URL:
+        return []
+    
+    return [json.loads(row) for row in await fetch_patient_rows(patient_id, days)]
+
 @app.get("/api/patients")
+@ttl_cache(30)
 async def list_patients():
     """Get all patients with recent data"""
     if not DATABASE_URL:
         return []
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT 
-                    patient_id, 
-                    COUNT(*) as total_records,
-                    MAX(timestamp) as last_update,
-                    MIN(timestamp) as first_record
-                FROM gait_records 
-                GROUP BY patient_id
-                ORDER BY last_update DESC
-                LIMIT 50
+        async with engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT to_json(p) FROM (
+                    SELECT 
+                        patient_id, 
+                        COUNT(*) as total_records,
+                        MAX(timestamp) as last_update,
+                        MIN(timestamp) as first_record
+                    FROM gait_records 
+                    GROUP BY patient_id
+                    ORDER BY last_update DESC
+                    LIMIT 50
+                ) p
             """))
             
-            columns = result.keys()
-            data = [dict(zip(columns, row)) for row in result.fetchall()]
-            
-            # Convert timestamps to strings
-            for record in data:
-                for key, value in record.items():
-                    if isinstance(value, datetime):
-                        record[key] = value.isoformat()
-            
-            return data
+            return [row[0] for row in result]
             
     except Exception as e:
         print(f"Error listing patients: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
+@app.get("/api/bundle/{patient_id}")
+async def get_patient_bundle(patient_id: str, days: int = 30):
+    """Get the patient list and one patient's data for the dashboard in a single request"""
+    return {
+        "patient_id": patient_id,
+        "patients": await list_patients(),
+        "data": await fetch_patient_data(patient_id, days),
+        "medication_history": await get_medication_history(patient_id)
+    }
+
 @app.post("/api/medication-change")
 async def log_medication_change(change: dict):
     """Log medication changes for correlation analysis"""
@@ -475,20 +859,10 @@ async def log_medication_change(change: dict):
         raise HTTPException(status_code=503, detail="Database not available")
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                INSERT INTO medication_changes (
-                    patient_id, change_date, medication_name,
-                    old_dosage, new_dosage, reason, pharmacist_id
-                ) VALUES (
-                    :patient_id, :change_date, :medication_name,
-                    :old_dosage, :new_dosage, :reason, :pharmacist_id
-                ) RETURNING id
-            """), {
+        async with engine.begin() as conn:
+            result = await conn.execute(INSERT_MEDICATION_CHANGE, {
                 'patient_id': change.get('patient_id'),
-                'change_date': change.get('change_date'),
+                'change_date': parse_timestamp(change.get('change_date')),
                 'medication_name': change.get('medication_name'),
                 'old_dosage': change.get('old_dosage'),
                 'new_dosage': change.get('new_dosage'),
@@ -496,7 +870,6 @@ async def log_medication_change(change: dict):
                 'pharmacist_id': change.get('pharmacist_id')
             })
             
-            conn.commit()
             record_id = result.fetchone()[0]
             print(f"Logged medication change for patient {change.get('patient_id')}")
             return {"status": "success", "id": str(record_id)}
@@ -512,26 +885,10 @@ async def get_medication_history(patient_id: str):
         return []
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT * FROM medication_changes 
-                WHERE patient_id = :patient_id
-                ORDER BY change_date DESC
-                LIMIT 100
-            """), {'patient_id': patient_id})
+        async with engine.connect() as conn:
+            result = await conn.execute(SELECT_MEDICATION_HISTORY, {'patient_id': patient_id})
             
-            columns = result.keys()
-            data = [dict(zip(columns, row)) for row in result.fetchall()]
-            
-            # Convert timestamps to strings for JSON serialization
-            for record in data:
-                for key, value in record.items():
-                    if isinstance(value, datetime):
-                        record[key] = value.isoformat()
-            
-            return data
+            return [row[0] for row in result]
             
     except Exception as e:
         print(f"Error getting medication history: {e}")
@@ -544,38 +901,26 @@ async def update_patient_thresholds(patient_id: str, thresholds: dict):
         raise HTTPException(status_code=503, detail="Database not available")
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
+        async with engine.begin() as conn:
             # Use UPSERT (INSERT ... ON CONFLICT) for PostgreSQL
-            conn.execute(text("""
-                INSERT INTO patient_thresholds (
-                    patient_id, walking_speed_threshold, asymmetry_threshold, double_support_threshold
-                ) VALUES (
-                    :patient_id, :speed_threshold, :asymmetry_threshold, :support_threshold
-                )
-                ON CONFLICT (patient_id) 
-                DO UPDATE SET
-                    walking_speed_threshold = EXCLUDED.walking_speed_threshold,
-                    asymmetry_threshold = EXCLUDED.asymmetry_threshold,
-                    double_support_threshold = EXCLUDED.double_support_threshold,
-                    updated_at = CURRENT_TIMESTAMP
-            """), {
+            await conn.execute(UPSERT_THRESHOLDS, {
                 'patient_id': patient_id,
                 'speed_threshold': thresholds.get('walking_speed_threshold', 0.8),
                 'asymmetry_threshold': thresholds.get('asymmetry_threshold', 10.0),
                 'support_threshold': thresholds.get('double_support_threshold', 30.0)
             })
             
-            conn.commit()
-            print(f"Updated thresholds for patient {patient_id}")
-            
-            return {
-                "status": "success",
-                "patient_id": patient_id,
-                "thresholds": thresholds,
-                "updated_at": datetime.now().isoformat()
-            }
+        # Drop the cached copy once the new values are committed, and stop in-flight reads of the old row from re-caching it
+        _threshold_generation[patient_id] = _threshold_generation.get(patient_id, 0) + 1
+        _threshold_cache.pop(patient_id, None)
+        print(f"Updated thresholds for patient {patient_id}")
+        
+        return {
+            "status": "success",
+            "patient_id": patient_id,
+            "thresholds": thresholds,
+            "updated_at": datetime.now().isoformat()
+        }
             
     except Exception as e:
         print(f"Error updating patient thresholds: {e}")
@@ -588,14 +933,8 @@ async def get_patient_thresholds_api(patient_id: str):
         return {"speed": 0.8, "asymmetry": 10.0, "double_support": 30.0}
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT walking_speed_threshold, asymmetry_threshold, double_support_threshold, updated_at
-                FROM patient_thresholds 
-                WHERE patient_id = :patient_id
-            """), {'patient_id': patient_id})
+        async with engine.connect() as conn:
+            result = await conn.execute(SELECT_THRESHOLDS_WITH_UPDATED, {'patient_id': patient_id})
             
             row = result.fetchone()
             if row:
@@ -621,105 +960,89 @@ async def get_patient_thresholds_api(patient_id: str):
         raise HTTPException(status_code=500, detail="Database error")
 
 @app.get("/api/alerts/recent")
+@ttl_cache(30)
 async def get_recent_alerts(hours: int = 24):
     """Get recent alerts across all patients"""
     if not DATABASE_URL:
         return []
         
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT patient_id, timestamp, walking_speed, walking_asymmetry, 
-                       double_support_time, asymmetry_alert, double_support_alert,
-                       speed_category
-                FROM gait_records 
-                WHERE timestamp >= NOW() - INTERVAL ':hours hours'
-                AND (asymmetry_alert = true OR double_support_alert = true OR walking_speed < 0.8)
-                ORDER BY timestamp DESC
+        async with engine.connect() as conn:
+            # Each branch emits finished alerts, so no per-row post-processing is needed
+            # A walking speed of 0 is treated as missing, as in the per-record alert checks
+            result = await conn.execute(text("""
+                SELECT type, patient_id, timestamp, value, severity, message
+                FROM (
+                    SELECT 'walking_speed_low' AS type, patient_id, timestamp,
+                           walking_speed AS value, 'high' AS severity,
+                           'Low walking speed: ' || round(walking_speed, 2) || ' m/s' AS message,
+                           1 AS ordinal
+                    FROM gait_records
+                    WHERE timestamp >= :cutoff AND walking_speed < 0.8 AND walking_speed <> 0
+                    UNION ALL
+                    SELECT 'asymmetry_high', patient_id, timestamp,
+                           walking_asymmetry, 'medium',
+                           'High asymmetry: ' || COALESCE(walking_asymmetry::text, 'N/A') || '%',
+                           2
+                    FROM gait_records
+                    WHERE timestamp >= :cutoff AND asymmetry_alert = true
+                    UNION ALL
+                    SELECT 'double_support_high', patient_id, timestamp,
+                           double_support_time, 'medium',
+                           'High double support: ' || COALESCE(double_support_time::text, 'N/A') || '%',
+                           3
+                    FROM gait_records
+                    WHERE timestamp >= :cutoff AND double_support_alert = true
+                ) alerts
+                ORDER BY timestamp DESC, ordinal
                 LIMIT 100
-            """), {'hours': hours})
+            """), {'cutoff': utc_now() - timedelta(hours=hours)})
             
             columns = result.keys()
-            data = [dict(zip(columns, row)) for row in result.fetchall()]
-            
-            # Convert timestamps and format alerts
-            alerts = []
-            for record in data:
-                record_time = record['timestamp'].isoformat() if record['timestamp'] else None
-                
-                # Check for speed alerts
-                if record.get('walking_speed') and record['walking_speed'] < 0.8:
-                    alerts.append({
-                        'type': 'walking_speed_low',
-                        'patient_id': record['patient_id'],
-                        'timestamp': record_time,
-                        'value': record['walking_speed'],
-                        'severity': 'high',
-                        'message': f'Low walking speed: {record["walking_speed"]:.2f} m/s'
-                    })
-                
-                # Check for asymmetry alerts
-                if record.get('asymmetry_alert'):
-                    alerts.append({
-                        'type': 'asymmetry_high',
-                        'patient_id': record['patient_id'],
-                        'timestamp': record_time,
-                        'value': record.get('walking_asymmetry'),
-                        'severity': 'medium',
-                        'message': f'High asymmetry: {record.get("walking_asymmetry", "N/A")}%'
-                    })
-                
-                # Check for double support alerts
-                if record.get('double_support_alert'):
-                    alerts.append({
-                        'type': 'double_support_high',
-                        'patient_id': record['patient_id'],
-                        'timestamp': record_time,
-                        'value': record.get('double_support_time'),
-                        'severity': 'medium',
-                        'message': f'High double support: {record.get("double_support_time", "N/A")}%'
-                    })
-            
-            return alerts
+            return [dict(zip(columns, row)) for row in result.fetchall()]
             
     except Exception as e:
         print(f"Error getting recent alerts: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
 @app.get("/api/stats")
+@ttl_cache(30)
 async def get_system_stats():
     """Get overall system statistics"""
     if not DATABASE_URL:
         return {"error": "Database not available"}
         
     try:
-        engine = create_engine(DATABASE_URL)
+        day_ago = utc_now() - timedelta(hours=24)
         
-        with engine.connect() as conn:
+        async with engine.connect() as conn:
             # Get patient count
-            patient_count = conn.execute(text("""
+            patient_count = await conn.scalar(text("""
                 SELECT COUNT(DISTINCT patient_id) FROM gait_records
-            """)).scalar()
+            """))
             
-            # Get total records
-            total_records = conn.execute(text("""
-                SELECT COUNT(*) FROM gait_records
-            """)).scalar()
+            # Get total records from the planner's row estimate rather than a full scan
+            total_records = await conn.scalar(text("""
+                SELECT reltuples::bigint FROM pg_class WHERE oid = 'gait_records'::regclass
+            """))
+            if total_records is None or total_records <= 0:
+                # Table not analyzed yet (-1, or 0 before PG 14), so there is no estimate
+                total_records = await conn.scalar(text("""
+                    SELECT COUNT(*) FROM gait_records
+                """))
             
             # Get recent activity (last 24 hours)
-            recent_activity = conn.execute(text("""
+            recent_activity = await conn.scalar(text("""
                 SELECT COUNT(*) FROM gait_records 
-                WHERE timestamp >= NOW() - INTERVAL '24 hours'
-            """)).scalar()
+                WHERE timestamp >= :cutoff
+            """), {'cutoff': day_ago})
             
             # Get alert count (last 24 hours)
-            recent_alerts = conn.execute(text("""
+            recent_alerts = await conn.scalar(text("""
                 SELECT COUNT(*) FROM gait_records 
-                WHERE timestamp >= NOW() - INTERVAL '24 hours'
+                WHERE timestamp >= :cutoff
                 AND (asymmetry_alert = true OR double_support_alert = true OR walking_speed < 0.8)
-            """)).scalar()
+            """), {'cutoff': day_ago})
             
             return {
                 "total_patients": patient_count,
@@ -750,6 +1073,7 @@ async def root():
             "gait_data": "/api/gait-data",
             "patients": "/api/patients",
             "patient_data": "/api/patient/{patient_id}/data",
+            "patient_bundle": "/api/bundle/{patient_id}",
             "medication_change": "/api/medication-change",
             "medication_history": "/api/patient/{patient_id}/medication-history",
             "patient_thresholds": "/api/patient/{patient_id}/thresholds",
@@ -779,5 +1103,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=PORT,
         reload=False,  # Set to False for production
-        access_log=True
+        access_log=True,
+        ws_ping_interval=20,
+        ws_ping_timeout=20
     )